@@ -1,63 +1,111 @@
 import streamlit as st
 import pandas as pd
 import qrcode
+import qrcode.image.svg
 import cv2
 import numpy as np
 from PIL import Image
 import time
+import hashlib
+import hmac
 import random
+import threading
+from streamlit_autorefresh import st_autorefresh
+
+try:
+    from pyzbar.pyzbar import ZBarSymbol, decode as zbar_decode
+except ImportError:  # 未安装 zbar 系统库时退回 OpenCV 识别
+    zbar_decode = None
+
+GROUPS = tuple(f"组{i}" for i in range(1, 31))
+
+# 选手页重跑间隔: 等待开赛时画面不变，只需每秒检查一次是否开赛；进行中需及时显示完赛
+REFRESH_WAITING_MS = 1000
+REFRESH_RUNNING_MS = 250
 
 # --- 1. 全局状态管理 (模拟数据库) ---
 @st.cache_resource
 class RaceManager:
     def __init__(self):
-        # 存储格式: {user_id: {'name': str, 'phone': str, 'group': str, 'finish_time': float}}
-        self.contestants = {} 
+        # 实例被 cache_resource 在所有会话间共享，读写都要加锁
+        self._lock = threading.RLock()
+        # 列式存储: 每列一个 list，行号由 user_id 映射
+        self._reset_table()
         self.start_time = None 
         self.is_running = False
+        self.version = 0  # 数据每变化一次加 1，用作榜单缓存的键
+        self._next_id = 0  # 重置比赛时不清零，旧二维码不会对应到新选手
+
+    def _reset_table(self):
+        # 每列一个普通 list，类型固定；DataFrame 只在 get_dataframe 中按列组装
+        self._names = []
+        self._phones = [] # 新增手机号
+        self._groups = []
+        self._finish_times = []  # float 秒数，未完成为 NaN
+        self._finish_time_strs = []  # 录入时格式化一次，之后不再变化
+        self._idx = {}  # user_id -> 行号
 
     def register(self, name, phone, group):
-        user_id = str(random.randint(100000, 999999))
-        self.contestants[user_id] = {
-            'name': name,
-            'phone': phone, # 新增手机号
-            'group': group,
-            'finish_time': None
-        }
-        return user_id
+        with self._lock:
+            # 自增序号保证唯一，随机后缀防止相邻编号被随手猜中
+            self._next_id += 1
+            user_id = f"{self._next_id:05d}{random.randint(0, 99):02d}"
+            self._idx[user_id] = len(self._names)
+            self._names.append(name)
+            self._phones.append(phone)
+            self._groups.append(group)
+            self._finish_times.append(np.nan)
+            self._finish_time_strs.append("--:--")
+            self.version += 1
+            return user_id
 
     def start_race(self):
-        self.is_running = True
-        self.start_time = time.time()
+        with self._lock:
+            self.is_running = True
+            self.start_time = time.time()
 
     def reset_race(self):
-        self.is_running = False
-        self.start_time = None
-        self.contestants = {} 
+        with self._lock:
+            self.is_running = False
+            self.start_time = None
+            self._reset_table()
+            self.version += 1
+
+    def get_finish_time(self, user_id):
+        with self._lock:
+            row = self._idx.get(user_id)
+            if row is None:
+                return None
+            ft = self._finish_times[row]
+            return None if np.isnan(ft) else ft
 
     def record_finish(self, user_id):
-        if user_id in self.contestants and self.start_time:
-            if self.contestants[user_id]['finish_time'] is None:
-                duration = time.time() - self.start_time
-                self.contestants[user_id]['finish_time'] = duration
-                return True, self.contestants[user_id]['name'], duration
-            else:
-                return False, "已录入成绩", self.contestants[user_id]['finish_time']
-        return False, "无效ID", 0
+        with self._lock:
+            if user_id in self._idx and self.start_time:
+                row = self._idx[user_id]
+                ft = self._finish_times[row]
+                if np.isnan(ft):
+                    duration = time.time() - self.start_time
+                    self._finish_times[row] = duration
+                    self._finish_time_strs[row] = self.format_time(duration)
+                    self.version += 1
+                    return True, self._names[row], duration
+                else:
+                    return False, "已录入成绩", ft
+            return False, "无效ID", 0
 
     def get_dataframe(self):
-        data = []
-        for uid, info in self.contestants.items():
-            ft = info['finish_time']
-            ft_str = self.format_time(ft) if ft else "--:--"
-            data.append({
-                "姓名": info['name'],
-                "手机号": info['phone'], # 表格新增显示手机号
-                "组别": info['group'],
-                "成绩": ft_str,
-                "状态": "已完成" if ft else "进行中/未开始"
+        with self._lock:
+            ft = np.array(self._finish_times, dtype='float64')
+            finished = ~np.isnan(ft)
+            return pd.DataFrame({
+                "姓名": list(self._names),
+                "手机号": list(self._phones), # 表格新增显示手机号
+                "组别": list(self._groups),
+                "成绩": list(self._finish_time_strs),
+                "状态": np.where(finished, "已完成", "进行中/未开始"),
+                "finish_time": ft, # 数值列，仅用于排序
             })
-        return pd.DataFrame(data)
 
     @staticmethod
     def format_time(seconds):
@@ -88,14 +136,93 @@ if 'user_id' not in st.session_state:
     st.session_state.user_id = None
 if 'user_info' not in st.session_state:
     st.session_state.user_info = {}
+if 'last_img_hash' not in st.session_state:
+    st.session_state.last_img_hash = None
+
+@st.cache_data(show_spinner=False)
+def _render_qr_svg(user_id: str) -> str:
+    # 二维码只与 user_id 有关，每个选手只需生成一次；输出 SVG，跳过 PIL 光栅化和 PNG 编码
+    qr = qrcode.QRCode(version=1, box_size=10, border=4)
+    qr.add_data(user_id)
+    qr.make(fit=True)
+    img_qr = qr.make_image(image_factory=qrcode.image.svg.SvgPathFillImage)
+    return img_qr.to_string(encoding="unicode")
+
+@st.cache_data(show_spinner=False, max_entries=1)
+def _build_leaderboard(version, _manager):
+    # 只有报名、录入成绩或重置后 version 才会变化，其余重跑直接命中缓存
+    df = _manager.get_dataframe()
+    if not df.empty:
+        df = df.sort_values(by="finish_time", na_position="last")
+    return df.drop(columns=["finish_time"])
+
+# 比赛进行中的秒表在浏览器端走字，服务端只下发一次已用时间，浏览器从 iframe 加载时刻往后计，
+# 不依赖手机与服务器时钟一致；格式与 RaceManager.format_time 一致
+LIVE_TIMER_HTML = """
+<div id="t" style="font-size: 80px; font-weight: bold; text-align: center; color: #00CC00; font-family: monospace;">00:00.00</div>
+<script>
+    const base = __ELAPSED_MS__;
+    const d0 = Date.now();  // 用挂钟差值，手机锁屏休眠期间也照常计时
+    const el = document.getElementById("t");
+    const pad = (n) => String(n).padStart(2, "0");
+    function tick() {
+        const s = (base + Date.now() - d0) / 1000;
+        el.textContent = pad(Math.floor(s / 60)) + ":" + pad(Math.floor(s % 60)) + "." + pad(Math.floor((s * 100) % 100));
+    }
+    tick();
+    setInterval(tick, 50);
+</script>
+"""
+
+def render_live_timer(start_time):
+    # 每个 start_time 只取一次服务端已用时间并存入 session_state，重跑时 HTML 不变，iframe 不会重新加载
+    cached = st.session_state.get('timer_base')
+    if cached is None or cached[0] != start_time:
+        cached = (start_time, int((time.time() - start_time) * 1000))
+        st.session_state.timer_base = cached
+    st.iframe(LIVE_TIMER_HTML.replace("__ELAPSED_MS__", str(cached[1])), height=130)
+
+QR_MAX_SIDE = 1024
+
+# 直接识别失败时依次尝试的预处理，命中即返回，减少重新拍照
+QR_FALLBACKS = (
+    lambda g: cv2.threshold(g, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)[1],
+    lambda g: cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(g),
+    lambda g: 255 - g,
+    lambda g: cv2.resize(g, None, fx=1.5, fy=1.5, interpolation=cv2.INTER_LINEAR),
+    lambda g: cv2.resize(g, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA),
+)
+
+@st.cache_resource
+def _qr_detector():
+    # 检测器在所有会话间共享，内部有状态，调用时需持锁
+    return cv2.QRCodeDetector(), threading.Lock()
 
 def decode_qr(image_buffer):
     try:
-        file_bytes = np.asarray(bytearray(image_buffer.read()), dtype=np.uint8)
-        img = cv2.imdecode(file_bytes, 1)
-        detector = cv2.QRCodeDetector()
-        data, bbox, _ = detector.detectAndDecode(img)
-        return data
+        # getbuffer() 是零拷贝的 memoryview，frombuffer 直接包装，不再复制整张 JPEG
+        file_bytes = np.frombuffer(image_buffer.getbuffer(), dtype=np.uint8)
+        # 灰度解码并把长边缩到 1024px 以内，检测耗时随像素数增长
+        img = cv2.imdecode(file_bytes, cv2.IMREAD_GRAYSCALE)
+        h, w = img.shape
+        scale = QR_MAX_SIDE / max(h, w)
+        if scale < 1:
+            img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        # 优先用 ZBar，手机低对比度照片上比 OpenCV 更快也更稳
+        if zbar_decode is not None:
+            res = zbar_decode(img, symbols=[ZBarSymbol.QRCODE])
+            if res:
+                return res[0].data.decode('utf-8')
+        detector, lock = _qr_detector()
+        with lock:
+            data, bbox, _ = detector.detectAndDecode(img)
+            if data:
+                return data
+            for preprocess in QR_FALLBACKS:
+                data, bbox, _ = detector.detectAndDecode(preprocess(img))
+                if data:
+                    return data
+        return None
     except Exception as e:
         return None
 
@@ -107,21 +234,18 @@ if st.session_state.page == 'register':
         name = st.text_input("请输入姓名")
         phone = st.text_input("请输入手机号") # 新增输入框
         
-        groups = [f"组{i}" for i in range(1, 31)]
-        
         col_g1, col_g2 = st.columns([3, 1])
         with col_g1:
             default_idx = 0
             if 'random_group_idx' in st.session_state:
                 default_idx = st.session_state.random_group_idx
-            selected_group = st.selectbox("选择组别", groups, index=default_idx)
+            selected_group = st.selectbox("选择组别", GROUPS, index=default_idx)
             
         with col_g2:
             st.write("") 
             st.write("") 
-            if st.form_submit_button("🎲 随机"):
-                st.session_state.random_group_idx = random.randint(0, 29)
-                st.rerun()
+            # 回调里改状态，提交后自然重跑一次即可，无需再手动 st.rerun()
+            st.form_submit_button("🎲 随机", on_click=lambda: st.session_state.update(random_group_idx=random.randrange(len(GROUPS))))
 
         submit = st.form_submit_button("生成参赛证")
         
@@ -145,7 +269,13 @@ elif st.session_state.page == 'admin_login':
     st.title("🔐 主办方登录")
     pwd = st.text_input("请输入密码", type="password")
     if st.button("登录"):
-        if pwd == "963852":
+        # 密码只以 SHA-256 十六进制摘要存放在 st.secrets 中，并做常数时间比较
+        try:
+            expected = st.secrets.get("admin_pw_sha256", "")
+        except FileNotFoundError:  # 未配置 secrets.toml
+            expected = ""
+        # 按字节比较，secret 中误填非 ASCII 字符时只会判为密码错误而不是抛异常
+        if expected and hmac.compare_digest(hashlib.sha256(pwd.encode()).hexdigest().encode(), str(expected).strip().lower().encode()):
             st.session_state.page = 'admin_dashboard'
             st.rerun()
         else:
@@ -160,34 +290,25 @@ elif st.session_state.page == 'contestant':
     info = st.session_state.user_info
     st.success(f"选手: {info['name']} ({info['phone']}) | {info['group']}")
     
-    qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(st.session_state.user_id)
-    qr.make(fit=True)
-    img_qr = qr.make_image(fill_color="black", back_color="white")
-    st.image(img_qr.get_image(), caption="终点请出示此二维码", width=250)
+    st.image(_render_qr_svg(st.session_state.user_id), caption="终点请出示此二维码", width=250)
     
     st.markdown("---")
     
-    timer_placeholder = st.empty()
-    
-    while True:
-        if manager.is_running and manager.start_time:
-            elapsed = time.time() - manager.start_time
-            my_data = manager.contestants.get(st.session_state.user_id)
-            if my_data and my_data['finish_time']:
-                final_time = manager.format_time(my_data['finish_time'])
-                timer_placeholder.markdown(f"<div class='big-timer' style='color:blue'>{final_time}</div>", unsafe_allow_html=True)
-                st.info("您已完成比赛！")
-                break 
-            else:
-                current_time_str = manager.format_time(elapsed)
-                timer_placeholder.markdown(f"<div class='big-timer'>{current_time_str}</div>", unsafe_allow_html=True)
+    # 每次脚本运行只渲染一次计时器，由前端定时触发重跑，不再占用服务端线程
+    if manager.is_running and manager.start_time:
+        my_finish = manager.get_finish_time(st.session_state.user_id)
+        if my_finish is not None:
+            final_time = manager.format_time(my_finish)
+            st.markdown(f"<div class='big-timer' style='color:blue'>{final_time}</div>", unsafe_allow_html=True)
+            st.info("您已完成比赛！")
         else:
-            timer_placeholder.markdown("<div class='big-timer' style='color:gray'>00:00.00</div>", unsafe_allow_html=True)
-            if not manager.is_running:
-                st.caption("等待主办方开始比赛...")
-        
-        time.sleep(0.1)
+            render_live_timer(manager.start_time)
+            st_autorefresh(interval=REFRESH_RUNNING_MS, key="tick")
+    else:
+        st.markdown("<div class='big-timer' style='color:gray'>00:00.00</div>", unsafe_allow_html=True)
+        if not manager.is_running:
+            st.caption("等待主办方开始比赛...")
+        st_autorefresh(interval=REFRESH_WAITING_MS, key="tick")
 
 # ================= 页面 4: 管理员/主办方后台 =================
 elif st.session_state.page == 'admin_dashboard':
@@ -212,23 +333,24 @@ elif st.session_state.page == 'admin_dashboard':
     img_file = st.camera_input("点击拍照扫描选手二维码", key="camera")
     
     if img_file is not None:
-        code_data = decode_qr(img_file)
-        if code_data:
-            success, name, duration = manager.record_finish(code_data)
-            if success:
-                st.success(f"✅ 录入成功！选手：{name}，用时：{manager.format_time(duration)}")
-                time.sleep(2) 
-                st.rerun() 
-            else:
-                if name == "已录入成绩":
-                    st.warning(f"⚠️ 该选手已录入，成绩：{manager.format_time(duration)}")
+        # 重跑时 camera_input 仍返回同一张照片，哈希相同则跳过，避免重复识别
+        img_hash = hashlib.blake2b(img_file.getbuffer(), digest_size=8).digest()
+        if img_hash != st.session_state.last_img_hash:
+            st.session_state.last_img_hash = img_hash
+            code_data = decode_qr(img_file)
+            if code_data:
+                success, name, duration = manager.record_finish(code_data)
+                if success:
+                    st.toast(f"录入成功！选手：{name}，用时：{manager.format_time(duration)}", icon="✅")
+                    st.rerun() 
                 else:
-                    st.error("❌ 无效的二维码或数据")
-        else:
-            st.error("❌ 未识别到二维码，请靠近一点重试")
+                    if name == "已录入成绩":
+                        st.warning(f"⚠️ 该选手已录入，成绩：{manager.format_time(duration)}")
+                    else:
+                        st.error("❌ 无效的二维码或数据")
+            else:
+                st.error("❌ 未识别到二维码，请靠近一点重试")
 
     st.markdown("### 📊 实时榜单")
-    df = manager.get_dataframe()
-    if not df.empty:
-        df = df.sort_values(by="成绩")
+    df = _build_leaderboard(manager.version, manager)
     st.dataframe(df, use_container_width=True)
\ No newline at end of file